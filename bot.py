@@ -1,10 +1,16 @@
 # bot.py
 import os
 import re
+import codecs
+import asyncio
 import json
+import html
 import time
 import requests
 import math
+import random
+import threading
+from collections import OrderedDict
 
 import matplotlib
 matplotlib.use("Agg")
@@ -15,6 +21,7 @@ from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
 
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
 
 
@@ -31,9 +38,32 @@ BASE_RPC_URL = ALCHEMY_RPC_URL  # primary
 
 DEXSCREENER_TOKEN_URL = "https://api.dexscreener.com/latest/dex/tokens/"
 
+# On-chain pricing from Uniswap v3 pools (DexScreener stays as fallback / cross-check)
+PRICE_SOURCE = os.environ.get("PRICE_SOURCE", "onchain").strip().lower()  # onchain | dexscreener
+UNISWAP_V3_FACTORY = "0x33128a8fc17869897dce68ed026d694621f6fdfd"
+USDC_TOKEN = "0x833589fcd6edb6e08f4c7c32d4f71b54bda02913"
+# Optional pool overrides; otherwise the deepest factory pool is used
+DRB_WETH_POOL = os.environ.get("DRB_WETH_POOL", "").strip().lower()
+WETH_USDC_POOL = os.environ.get("WETH_USDC_POOL", "").strip().lower()
+PRICE_CROSSCHECK_S = int(os.environ.get("PRICE_CROSSCHECK_S", "3600"))  # 0 = never
+PRICE_MAX_DEVIATION = float(os.environ.get("PRICE_MAX_DEVIATION", "0.05"))
+
+# Total latency budget per command (fetches + rendering); fetches stop
+# RENDER_RESERVE_S early so there is always time left to draw and reply
+COMMAND_BUDGET_S = float(os.environ.get("COMMAND_BUDGET_S", "15"))
+RENDER_RESERVE_S = float(os.environ.get("RENDER_RESERVE_S", "3"))
+
 GROK_WALLET_URL = "https://thegrokwallet.com/"
 UA_HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; DebtReliefBot/1.0)"}
 
+# Persistent ERC-20 metadata (decimals, symbol, name, total supply)
+TOKEN_METADATA_PATH = os.environ.get("TOKEN_METADATA_PATH", "token_metadata.json")
+TOKEN_SUPPLY_REFRESH_S = int(os.environ.get("TOKEN_SUPPLY_REFRESH_S", "86400"))  # 24h
+TOKEN_SUPPLY_RETRY_S = int(os.environ.get("TOKEN_SUPPLY_RETRY_S", "3600"))  # after a failed refresh
+
+# HTML scrapes stop at the target marker and never read more than this
+SCRAPE_MAX_BYTES = int(os.environ.get("SCRAPE_MAX_BYTES", str(2 * 1024 * 1024)))
+
 GROK_WALLET = "0xb1058c959987e3513600eb5b4fd82aeee2a0e4f9"
 DRB_TOKEN = "0x3ec2156d4c0a9cbdab4a016633b7bcf6a8d68ea2"
 WETH_TOKEN = "0x4200000000000000000000000000000000000006"
@@ -48,6 +78,21 @@ GROK_BG_PATH = "assets/grok_wallet_bg.png"
 CARD_W = 896
 CARD_H = 658
 
+# Image encoding profile for /grok and /grok2 output:
+# png_default, png_optimized, png_fast, jpeg, webp.
+# Empty keeps each render's previous encoding (donut: png_default, card: png_optimized)
+IMAGE_PROFILE = os.environ.get("IMAGE_PROFILE", "").strip().lower()
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "85"))  # jpeg/webp only
+IMAGE_TARGET_BYTES = int(os.environ.get("IMAGE_TARGET_BYTES", "0"))  # 0 = no size target
+DONUT_DPI = int(os.environ.get("DONUT_DPI", "170"))
+
+# Spam control: identical commands in a chat are answered once per window,
+# and each user may trigger a render at most once per cooldown
+COALESCE_WINDOW_S = float(os.environ.get("COALESCE_WINDOW_S", "10"))
+USER_COOLDOWN_S = float(os.environ.get("USER_COOLDOWN_S", "30"))
+# Send the coalesced reply to the newest duplicate instead of the first message
+COALESCE_REPLY_TO_LATEST = os.environ.get("COALESCE_REPLY_TO_LATEST", "1").strip() == "1"
+
 
 # ================= HELPERS =================
 
@@ -59,42 +104,65 @@ def fmt_compact_b(n: float) -> str:
     return f"{n / 1_000_000_000:.2f}B"
 
 
-def _rpc_call(method: str, params: list):
-    payload = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
-    # Try Alchemy first, then fallback to Base public RPC
+def _timeout_for(deadline: float | None, cap: float = 20) -> float:
+    """Per-request timeout that never runs past `deadline` (time.monotonic())."""
+    if deadline is None:
+        return cap
+    left = deadline - time.monotonic()
+    if left <= 0.05:
+        raise TimeoutError("Command deadline exceeded")
+    return min(cap, left)
+
+
+def _rpc_batch(
+    calls: list[tuple[str, list]],
+    deadline: float | None = None,
+    required: list[int] | None = None,
+) -> list:
+    """
+    Send several JSON-RPC calls in one HTTP request.
+    Returns results in call order; a call that errored yields None.
+    Alchemy is tried first; the Base public RPC is retried when the request fails
+    or any `required` result (default: all) is missing.
+    """
+    payload = [
+        {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+        for i, (method, params) in enumerate(calls)
+    ]
+    needed = range(len(calls)) if required is None else required
     for url in [ALCHEMY_RPC_URL, BASE_FALLBACK_RPC_URL]:
         try:
-            r = requests.post(url, json=payload, headers=UA_HEADERS, timeout=20)
+            r = requests.post(url, json=payload, headers=UA_HEADERS, timeout=_timeout_for(deadline))
             r.raise_for_status()
             j = r.json()
-            if "error" in j:
-                raise RuntimeError(str(j["error"]))
-            return j["result"]
+            if not isinstance(j, list):
+                raise RuntimeError(str(j.get("error") if isinstance(j, dict) else j))
+            by_id = {it.get("id"): it for it in j if isinstance(it, dict)}
+            results = [(by_id.get(i) or {}).get("result") for i in range(len(calls))]
+            if url != BASE_FALLBACK_RPC_URL and any(results[i] is None for i in needed):
+                continue
+            return results
         except Exception:
             if url == BASE_FALLBACK_RPC_URL:
                 raise
             continue
 
 
-def _pad32_hex_address(addr: str) -> str:
-    return addr.lower().replace("0x", "").rjust(64, "0")
-
+def _eth_call_params(to_addr: str, data: str) -> list:
+    return [{"to": to_addr, "data": data}, "latest"]
 
-def _eth_call(to_addr: str, data: str) -> str:
-    return _rpc_call("eth_call", [{"to": to_addr, "data": data}, "latest"])
 
-
-def erc20_decimals(token: str) -> int:
-    return int(_eth_call(token, "0x313ce567"), 16)
+def _pad32_hex_address(addr: str) -> str:
+    return addr.lower().replace("0x", "").rjust(64, "0")
 
 
-def erc20_balance_of(token: str, wallet: str) -> int:
-    data = "0x70a08231" + _pad32_hex_address(wallet)
-    return int(_eth_call(token, data), 16)
+def _balance_of_data(wallet: str) -> str:
+    """Calldata for ERC-20 balanceOf(wallet)."""
+    return "0x70a08231" + _pad32_hex_address(wallet)
 
 
-def fetch_price_usd(token: str) -> float:
-    r = requests.get(DEXSCREENER_TOKEN_URL + token, headers=UA_HEADERS, timeout=20)
+def fetch_price_usd(token: str, deadline: float | None = None) -> float:
+    r = requests.get(DEXSCREENER_TOKEN_URL + token, headers=UA_HEADERS, timeout=_timeout_for(deadline))
     r.raise_for_status()
     pairs = r.json().get("pairs") or []
 
@@ -116,16 +184,161 @@ def fetch_price_usd(token: str) -> float:
     return best_price
 
 
-# ================= DRB STATS HELPERS =================
+# ================= CACHE =================
+
+# Sentinel returned by cache_get on a miss (None is a valid, negatively cached value)
+CACHE_MISS = object()
+
+# name -> {"ttl", "max_size", "jitter", "negative_ttl", "entries": OrderedDict, "stats": {...}}
+_CACHES = {}
+_CACHE_LOCK = threading.Lock()
 
-# 15-minute cache for /grok stats data
-_GROK_STATS_CACHE = {"ts": 0, "data": None}
-_GROK_STATS_CACHE_TTL = 900  # 15 minutes
 
-# Holder count cache (60 min)
-_HOLDERS_CACHE = {}
+def cache_namespace(name: str, ttl: float, max_size: int = 256, jitter: float = 0.1, negative_ttl: float | None = None):
+    """
+    Register a cache namespace.
+    Entries expire after ttl shortened by up to `jitter` (fraction) so they don't expire together;
+    None values use negative_ttl. Least recently used entries are evicted past max_size.
+    """
+    _CACHES[name] = {
+        "ttl": ttl,
+        "max_size": max_size,
+        "jitter": jitter,
+        "negative_ttl": ttl if negative_ttl is None else negative_ttl,
+        "entries": OrderedDict(),
+        "stats": {"hits": 0, "misses": 0, "stale_hits": 0, "evictions": 0},
+    }
 
 
+def cache_lookup(name: str, key) -> tuple:
+    """
+    (value, fresh) in one read and one counter update; (CACHE_MISS, False) when absent.
+    Expired entries that were not evicted yet come back with fresh=False.
+    """
+    ns = _CACHES[name]
+    with _CACHE_LOCK:
+        e = ns["entries"].get(key)
+        if e is None:
+            ns["stats"]["misses"] += 1
+            return CACHE_MISS, False
+        ns["entries"].move_to_end(key)
+        if time.time() < e["expires"]:
+            ns["stats"]["hits"] += 1
+            return e["value"], True
+        ns["stats"]["stale_hits"] += 1
+        return e["value"], False
+
+
+def cache_get(name: str, key, allow_stale: bool = False):
+    """Cached value or CACHE_MISS. allow_stale returns expired entries that were not evicted yet."""
+    ns = _CACHES[name]
+    with _CACHE_LOCK:
+        e = ns["entries"].get(key)
+        if e is None:
+            ns["stats"]["misses"] += 1
+            return CACHE_MISS
+        ns["entries"].move_to_end(key)
+        if time.time() < e["expires"]:
+            ns["stats"]["hits"] += 1
+            return e["value"]
+        if allow_stale:
+            ns["stats"]["stale_hits"] += 1
+            return e["value"]
+        ns["stats"]["misses"] += 1
+        return CACHE_MISS
+
+
+def cache_set(name: str, key, value):
+    ns = _CACHES[name]
+    ttl = ns["negative_ttl"] if value is None else ns["ttl"]
+    ttl *= 1 - random.uniform(0, ns["jitter"])
+    with _CACHE_LOCK:
+        entries = ns["entries"]
+        entries[key] = {"value": value, "expires": time.time() + ttl}
+        entries.move_to_end(key)
+        while len(entries) > ns["max_size"]:
+            entries.popitem(last=False)
+            ns["stats"]["evictions"] += 1
+
+
+def cache_delete(name: str, key):
+    with _CACHE_LOCK:
+        _CACHES[name]["entries"].pop(key, None)
+
+
+def cache_stats() -> dict:
+    with _CACHE_LOCK:
+        return {name: {**ns["stats"], "size": len(ns["entries"])} for name, ns in _CACHES.items()}
+
+
+cache_namespace("balances", ttl=900, max_size=1)  # 15 minutes
+cache_namespace("grok_stats", ttl=900, max_size=1)  # 15 minutes
+cache_namespace("holders", ttl=3600, max_size=512, negative_ttl=300)  # 60 min, failures 5 min
+# url -> {"etag", "last_modified", "value"} from the last successful scrape
+cache_namespace("scrape_validators", ttl=86400, max_size=256, jitter=0)
+# (token0, token1) -> deepest Uniswap v3 pool; pairs without a pool are retried hourly
+cache_namespace("v3_pools", ttl=86400, max_size=64, negative_ttl=3600)
+# Spam control: expiry is the window itself, so no jitter
+# (chat_id, command) -> {"busy": bool, "latest": Message | None}
+cache_namespace("chat_replies", ttl=COALESCE_WINDOW_S, max_size=1024, jitter=0)
+# (user_id, command) -> True while the user is cooling down
+cache_namespace("user_cooldown", ttl=USER_COOLDOWN_S, max_size=4096, jitter=0)
+
+
+# ================= STREAMING SCRAPES =================
+
+
+def _stream_scrape(url: str, headers: dict, extract, deadline: float | None = None):
+    """
+    GET an HTML page in chunks and return extract(text, done, state) as soon as it is
+    not None. `state` persists across chunks so extractors resume where they stopped.
+    Reading stops at SCRAPE_MAX_BYTES. Repeat scrapes send If-None-Match /
+    If-Modified-Since and reuse the previous value on 304.
+    """
+    prev = cache_get("scrape_validators", url)
+    if prev is CACHE_MISS:
+        prev = {}
+    h = dict(headers)
+    h["Accept-Encoding"] = "gzip, deflate"
+    if "value" in prev:
+        if prev.get("etag"):
+            h["If-None-Match"] = prev["etag"]
+        if prev.get("last_modified"):
+            h["If-Modified-Since"] = prev["last_modified"]
+
+    with requests.get(url, headers=h, timeout=_timeout_for(deadline), stream=True) as r:
+        if r.status_code == 304 and "value" in prev:
+            return prev["value"]
+        r.raise_for_status()
+
+        decoder = codecs.getincrementaldecoder(r.encoding or "utf-8")(errors="ignore")
+        text = ""
+        state = {}
+        read = 0
+        value = None
+        for chunk in r.iter_content(chunk_size=16384):
+            read += len(chunk)
+            text += decoder.decode(chunk)
+            capped = read >= SCRAPE_MAX_BYTES
+            value = extract(text, capped, state)
+            if value is not None or capped:
+                break
+            _timeout_for(deadline)
+        else:
+            text += decoder.decode(b"", final=True)
+            value = extract(text, True, state)
+
+        if value is not None:
+            cache_set("scrape_validators", url, {
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "value": value,
+            })
+        return value
+
+
+# ================= DRB STATS HELPERS =================
+
 def _short_addr_dots(a: str, left: int = 5, right: int = 5) -> str:
     if not a:
         return ""
@@ -154,9 +367,9 @@ def _fmt_big(n: float) -> str:
     return f"{n:.0f}"
 
 
-def fetch_price_and_fdv(token_addr: str):
+def fetch_price_and_fdv(token_addr: str, deadline: float | None = None):
     """Fetch price and FDV (market cap) from DexScreener."""
-    r = requests.get(DEXSCREENER_TOKEN_URL + token_addr, headers=UA_HEADERS, timeout=20)
+    r = requests.get(DEXSCREENER_TOKEN_URL + token_addr, headers=UA_HEADERS, timeout=_timeout_for(deadline))
     r.raise_for_status()
     pairs = r.json().get("pairs") or []
 
@@ -177,24 +390,48 @@ def fetch_price_and_fdv(token_addr: str):
     return best_price, best_fdv
 
 
-def basescan_token_holder_count(token_addr: str):
+# Raw HTML after a "Holders" label that must be read before giving up on it
+_HOLDERS_WINDOW = 3000
+_HOLDERS_LABEL_RE = re.compile(r"(?i)\bholders\b")
+_HOLDERS_VALUE_RE = re.compile(r"Holders\b(?:\s|&nbsp;|<[^>]*>)*([0-9][0-9,]*)\b", re.IGNORECASE)
+
+
+def _extract_basescan_holders(html: str, done: bool, state: dict):
+    """Holder count from partial basescan HTML; None until a complete "Holders" block is seen."""
+    pos = state.get("pos", 0)
+    for lm in _HOLDERS_LABEL_RE.finditer(html, pos):
+        if lm.start() + _HOLDERS_WINDOW > len(html) and not done:
+            # Resume at this label once more HTML has arrived
+            state["pos"] = lm.start()
+            return None
+
+        # Label followed by tags/whitespace and the number, matched on the raw HTML
+        m = _HOLDERS_VALUE_RE.match(html, lm.start(), lm.start() + _HOLDERS_WINDOW)
+        if m:
+            n = int(m.group(1).replace(",", ""))
+            if n > 0:
+                return n
+
+    # Every label so far was rejected; only a label split across chunks can be left
+    state["pos"] = max(pos, len(html) - len("holders") + 1)
+    return None
+
+
+def basescan_token_holder_count(token_addr: str, deadline: float | None = None):
     """
     Return current holder count for an ERC-20 token on Base.
     1) Try Etherscan v2 tokenholdercount
     2) Fallback: scrape basescan.org/token/<addr>
-    Cache TTL: 60 minutes (in-memory).
+    Cache TTL: 60 minutes, failed lookups 5 minutes (in-memory).
     """
     try:
         token = (token_addr or "").strip().lower()
         if not token or not token.startswith("0x"):
             return None
 
-        now = time.time()
-        c = _HOLDERS_CACHE.get(token)
-
-        if c and (now - float(c.get("ts") or 0.0)) <= 3600:
-            v = int(c.get("count") or 0)
-            return v if v > 0 else None
+        c = cache_get("holders", token)
+        if c is not CACHE_MISS:
+            return c
 
         # 1) Etherscan v2
         try:
@@ -207,7 +444,7 @@ def basescan_token_holder_count(token_addr: str):
             if ETHERSCAN_APIKEY:
                 params["apikey"] = ETHERSCAN_APIKEY
 
-            r = requests.get("https://api.etherscan.io/v2/api", params=params, timeout=20)
+            r = requests.get("https://api.etherscan.io/v2/api", params=params, timeout=_timeout_for(deadline))
             r.raise_for_status()
             j = r.json() if r.content else {}
 
@@ -215,7 +452,7 @@ def basescan_token_holder_count(token_addr: str):
                 res = j.get("result")
                 n = int(str(res)) if res is not None else 0
                 if n > 0:
-                    _HOLDERS_CACHE[token] = {"ts": now, "count": n}
+                    cache_set("holders", token, n)
                     return n
         except Exception:
             pass
@@ -223,38 +460,26 @@ def basescan_token_holder_count(token_addr: str):
         # 2) Fallback: scrape Basescan token page
         try:
             url = f"https://basescan.org/token/{token}"
-            r = requests.get(
+            n = _stream_scrape(
                 url,
-                timeout=20,
-                headers={
+                {
                     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
                     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
                     "Accept-Language": "en-US,en;q=0.9",
                 },
+                _extract_basescan_holders,
+                deadline,
             )
-            r.raise_for_status()
-            html = r.text or ""
-
-            html = re.sub(r"(?is)<script[^>]*>.*?</script>", " ", html)
-            html = re.sub(r"(?is)<style[^>]*>.*?</style>", " ", html)
-            text = re.sub(r"(?s)<[^>]+>", " ", html)
-            text = re.sub(r"\s+", " ", text).strip()
-
-            start_idx = text.lower().find("overview")
-            search_space = text[start_idx:] if start_idx != -1 else text
-
-            m = re.search(r"\bHolders\b\s*([0-9][0-9,]*)\b", search_space, re.IGNORECASE)
-            if not m:
-                m = re.search(r"\bHolders\b\s*([0-9][0-9,]*)\b", text, re.IGNORECASE)
-
-            if m:
-                n = int(m.group(1).replace(",", ""))
-                if n > 0:
-                    _HOLDERS_CACHE[token] = {"ts": now, "count": n}
-                    return n
+            if n:
+                cache_set("holders", token, n)
+                return n
         except Exception:
             pass
 
+        # Don't remember a miss that was only caused by running out of budget
+        if deadline is None or time.monotonic() < deadline:
+            cache_set("holders", token, None)
+
     except Exception:
         return None
 
@@ -406,30 +631,405 @@ def draw_box_text_centered(
     draw.text((px, start_y + h1 + gap1 + h2 + gap2), usd, font=font_usd, fill=color_usd)
 
 
+# ================= IMAGE ENCODING =================
+
+# Profile name -> (PIL format, file extension, save kwargs)
+_IMAGE_PROFILES = {
+    "png_default": ("PNG", "png", {}),
+    "png_optimized": ("PNG", "png", {"optimize": True}),
+    "png_fast": ("PNG", "png", {"compress_level": 1}),
+    "jpeg": ("JPEG", "jpg", {"optimize": False, "progressive": False, "subsampling": "4:2:0"}),
+    "webp": ("WEBP", "webp", {"method": 4}),
+}
+
+# Encoding each render kind used before profiles existed
+_DEFAULT_PROFILES = {"donut": "png_default", "card": "png_optimized"}
+
+# Last encode result per render kind ("donut", "card")
+_RENDER_STATS = {}
+
+
+def _resolve_profile(kind: str, profile: str | None = None) -> str:
+    profile = (profile or IMAGE_PROFILE or _DEFAULT_PROFILES.get(kind, "png_optimized")).strip().lower()
+    return profile if profile in _IMAGE_PROFILES else _DEFAULT_PROFILES.get(kind, "png_optimized")
+
+
+def _record_render(kind: str, profile: str, buf: BytesIO, size: tuple[int, int], elapsed_ms: float, quality: int | None):
+    nbytes = buf.getbuffer().nbytes
+    _RENDER_STATS[kind] = {
+        "profile": profile,
+        "encode_ms": elapsed_ms,
+        "bytes": nbytes,
+        "size": size,
+        "quality": quality,
+        "ts": time.time(),
+    }
+    print(f"render {kind}: profile={profile} {size[0]}x{size[1]} {nbytes:,} bytes in {elapsed_ms:.1f} ms")
+
+
+def _save_image(img: Image.Image, fmt: str, opts: dict, quality: int) -> BytesIO:
+    buf = BytesIO()
+    kwargs = dict(opts)
+    if fmt in ("JPEG", "WEBP"):
+        kwargs["quality"] = quality
+    img.save(buf, format=fmt, **kwargs)
+    return buf
+
+
+def encode_image(img: Image.Image, kind: str, profile: str | None = None) -> BytesIO:
+    """
+    Encode a rendered image with the configured profile.
+    Lossy profiles step quality down (then downscale) until IMAGE_TARGET_BYTES is met;
+    PNG profiles only downscale. Encode time and size are logged and kept in _RENDER_STATS.
+    """
+    profile = _resolve_profile(kind, profile)
+    fmt, ext, opts = _IMAGE_PROFILES[profile]
+
+    t0 = time.perf_counter()
+    img = img.convert("RGB")
+    quality = max(1, min(100, IMAGE_QUALITY))
+    buf = _save_image(img, fmt, opts, quality)
+
+    if IMAGE_TARGET_BYTES > 0:
+        while buf.getbuffer().nbytes > IMAGE_TARGET_BYTES:
+            if fmt in ("JPEG", "WEBP") and quality > 40:
+                quality = max(40, quality - 10)
+            elif img.width > 320:
+                img = img.resize((int(img.width * 0.85), int(img.height * 0.85)), Image.LANCZOS)
+            else:
+                break
+            buf = _save_image(img, fmt, opts, quality)
+
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    _record_render(kind, profile, buf, img.size, elapsed_ms, quality if fmt in ("JPEG", "WEBP") else None)
+
+    buf.name = f"{kind}.{ext}"
+    buf.seek(0)
+    return buf
+
+
+# ================= TOKEN METADATA =================
+
+# token -> {"decimals", "symbol", "name", "total_supply", "supply_ts", "supply_retry_ts"}
+_TOKEN_META = {}
+_TOKEN_META_LOCK = threading.Lock()
+_TOKEN_META_LOADED = {"done": False}
+
+_SEL_DECIMALS = "0x313ce567"
+_SEL_SYMBOL = "0x95d89b41"
+_SEL_NAME = "0x06fdde03"
+_SEL_TOTAL_SUPPLY = "0x18160ddd"
+
+
+def _decode_abi_string(res: str | None) -> str:
+    """Decode an ABI string return value (or a legacy bytes32 one)."""
+    if not res or len(res) <= 2:
+        return ""
+    raw = bytes.fromhex(res[2:])
+    if len(raw) == 32:
+        return raw.rstrip(b"\0").decode("utf-8", "ignore")
+    off = int.from_bytes(raw[:32], "big")
+    ln = int.from_bytes(raw[off:off + 32], "big")
+    return raw[off + 32:off + 32 + ln].decode("utf-8", "ignore")
+
+
+def _load_token_metadata():
+    if _TOKEN_META_LOADED["done"]:
+        return
+    _TOKEN_META_LOADED["done"] = True
+    try:
+        with open(TOKEN_METADATA_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for token, meta in (data or {}).items():
+            if isinstance(meta, dict) and "decimals" in meta:
+                _TOKEN_META[token.lower()] = meta
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print("token metadata load error:", repr(e))
+
+
+def _save_token_metadata():
+    try:
+        tmp = TOKEN_METADATA_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_TOKEN_META, f, indent=2, sort_keys=True)
+        os.replace(tmp, TOKEN_METADATA_PATH)
+    except Exception as e:
+        print("token metadata save error:", repr(e))
+
+
+def token_metadata(tokens: list[str], deadline: float | None = None) -> dict:
+    """
+    Metadata for ERC-20 tokens, served from memory / TOKEN_METADATA_PATH.
+    Unknown tokens are fetched (decimals, symbol, name, totalSupply) in one batched
+    RPC request; known ones only refresh totalSupply every TOKEN_SUPPLY_REFRESH_S.
+    """
+    tokens = [t.lower() for t in tokens]
+    with _TOKEN_META_LOCK:
+        _load_token_metadata()
+        now = time.time()
+        missing = [t for t in tokens if t not in _TOKEN_META]
+        stale = [
+            t for t in tokens
+            if t in _TOKEN_META
+            and (now - float(_TOKEN_META[t].get("supply_ts") or 0)) >= TOKEN_SUPPLY_REFRESH_S
+            and now >= float(_TOKEN_META[t].get("supply_retry_ts") or 0)
+        ]
+
+        if missing or stale:
+            calls = []
+            for t in missing:
+                calls.append(("eth_call", _eth_call_params(t, _SEL_DECIMALS)))
+                calls.append(("eth_call", _eth_call_params(t, _SEL_SYMBOL)))
+                calls.append(("eth_call", _eth_call_params(t, _SEL_NAME)))
+                calls.append(("eth_call", _eth_call_params(t, _SEL_TOTAL_SUPPLY)))
+            for t in stale:
+                calls.append(("eth_call", _eth_call_params(t, _SEL_TOTAL_SUPPLY)))
+
+            try:
+                # Only decimals are required; the fallback RPC is retried for those
+                res = _rpc_batch(calls, deadline, required=[4 * k for k in range(len(missing))])
+            except Exception:
+                # Known tokens keep serving their last total supply
+                if missing:
+                    raise
+                res = [None] * len(calls)
+
+            i = 0
+            for t in missing:
+                dec, sym, name, supply = res[i:i + 4]
+                i += 4
+                if dec is None:
+                    raise RuntimeError(f"decimals() failed for {t}")
+                _TOKEN_META[t] = {
+                    "decimals": int(dec, 16),
+                    "symbol": _decode_abi_string(sym),
+                    "name": _decode_abi_string(name),
+                    "total_supply": str(int(supply, 16)) if supply else None,
+                    "supply_ts": now if supply else 0,
+                    "supply_retry_ts": 0 if supply else now + TOKEN_SUPPLY_RETRY_S,
+                }
+            changed = bool(missing)
+            for t in stale:
+                supply = res[i]
+                i += 1
+                if supply:
+                    _TOKEN_META[t]["total_supply"] = str(int(supply, 16))
+                    _TOKEN_META[t]["supply_ts"] = now
+                    _TOKEN_META[t]["supply_retry_ts"] = 0
+                    changed = True
+                else:
+                    # Back off instead of retrying on every refresh
+                    _TOKEN_META[t]["supply_retry_ts"] = now + TOKEN_SUPPLY_RETRY_S
+
+            if changed:
+                _save_token_metadata()
+
+        return {t: _TOKEN_META[t] for t in tokens}
+
+
+def token_symbol(token: str, default: str = "") -> str:
+    """Symbol from the in-memory registry (no RPC), or `default` if not loaded yet."""
+    meta = _TOKEN_META.get(token.lower()) or {}
+    return meta.get("symbol") or default
+
+
+# ================= ON-CHAIN PRICES =================
+
+_V3_FEE_TIERS = (100, 500, 3000, 10000)
+_SEL_GET_POOL = "0x1698ee82"  # getPool(address,address,uint24)
+_SEL_LIQUIDITY = "0x1a686502"  # liquidity()
+_SEL_SLOT0 = "0x3850c7bd"  # slot0()
+
+# Tokens whose on-chain price disagreed with DexScreener at the last cross-check
+_PRICE_CROSSCHECK = {"ts": 0, "running": False, "deviating": set()}
+_PRICE_CROSSCHECK_LOCK = threading.Lock()
+
+
+def _sort_tokens(a: str, b: str) -> tuple[str, str]:
+    a, b = a.lower(), b.lower()
+    return (a, b) if int(a, 16) < int(b, 16) else (b, a)
+
+
+def _discover_v3_pool(
+    token_a: str,
+    token_b: str,
+    override: str = "",
+    deadline: float | None = None,
+) -> str | None:
+    """Find the deepest Uniswap v3 pool for a pair via the factory (cached)."""
+    if override:
+        return override
+    key = _sort_tokens(token_a, token_b)
+    cached = cache_get("v3_pools", key)
+    if cached is not CACHE_MISS:
+        return cached
+
+    t0, t1 = key
+    calls = []
+    for fee in _V3_FEE_TIERS:
+        data = _SEL_GET_POOL + _pad32_hex_address(t0) + _pad32_hex_address(t1) + hex(fee)[2:].rjust(64, "0")
+        calls.append(("eth_call", _eth_call_params(UNISWAP_V3_FACTORY, data)))
+
+    pools = []
+    for res in _rpc_batch(calls, deadline):
+        if res and int(res, 16) != 0:
+            pools.append("0x" + res[-40:].lower())
+    if not pools:
+        cache_set("v3_pools", key, None)
+        return None
+
+    liqs = _rpc_batch([("eth_call", _eth_call_params(p, _SEL_LIQUIDITY)) for p in pools], deadline)
+    best = max(zip(pools, liqs), key=lambda pl: int(pl[1], 16) if pl[1] else -1)
+    cache_set("v3_pools", key, best[0])
+    return best[0]
+
+
+def _price_from_slot0(slot0_hex: str, base: str, quote: str, base_dec: int, quote_dec: int) -> float:
+    """Price of `base` in units of `quote` from a v3 slot0() result."""
+    raw = slot0_hex[2:] if slot0_hex.startswith("0x") else slot0_hex
+    sqrt_price_x96 = int(raw[:64], 16)
+    if sqrt_price_x96 == 0:
+        raise RuntimeError("Empty pool")
+
+    # token1 per token0 in raw units
+    p = (sqrt_price_x96 / 2 ** 96) ** 2
+    token0, _ = _sort_tokens(base, quote)
+    if base.lower() == token0:
+        return p * 10 ** (base_dec - quote_dec)
+    return (1 / p) * 10 ** (base_dec - quote_dec)
+
+
+def _run_price_crosscheck(prices: dict):
+    try:
+        deviating = set()
+        for token, ours in prices.items():
+            try:
+                theirs = fetch_price_usd(token)
+            except Exception:
+                # Keep the previous verdict when DexScreener is unavailable
+                if token in _PRICE_CROSSCHECK["deviating"]:
+                    deviating.add(token)
+                continue
+            dev = abs(ours - theirs) / theirs if theirs else 0.0
+            if dev > PRICE_MAX_DEVIATION:
+                print(f"price crosscheck {token}: onchain={ours} dexscreener={theirs} deviation={dev:.1%}")
+                deviating.add(token)
+
+        newly = deviating - _PRICE_CROSSCHECK["deviating"]
+        _PRICE_CROSSCHECK["deviating"] = deviating
+        if newly:
+            # Don't keep serving balances valued at the suspect price
+            cache_delete("balances", GROK_WALLET)
+    finally:
+        with _PRICE_CROSSCHECK_LOCK:
+            _PRICE_CROSSCHECK["running"] = False
+
+
+def _crosscheck_prices(prices: dict):
+    """
+    Compare on-chain prices ({token: usd}) with DexScreener at most once per
+    PRICE_CROSSCHECK_S, in a background thread so refreshes stay one round trip.
+    Tokens that deviate by more than PRICE_MAX_DEVIATION are priced from
+    DexScreener until a later cross-check agrees again.
+    """
+    if PRICE_CROSSCHECK_S <= 0:
+        return
+    # Refreshes run in worker threads (/grok and /grok2 concurrently): check and
+    # claim the slot atomically so only one cross-check starts
+    with _PRICE_CROSSCHECK_LOCK:
+        now = time.time()
+        if _PRICE_CROSSCHECK["running"] or (now - _PRICE_CROSSCHECK["ts"]) < PRICE_CROSSCHECK_S:
+            return
+        _PRICE_CROSSCHECK["ts"] = now
+        _PRICE_CROSSCHECK["running"] = True
+    threading.Thread(target=_run_price_crosscheck, args=(prices,), daemon=True).start()
+
+
 # ================= BALANCES =================
 
-def fetch_balances_and_values():
-    drb_dec = erc20_decimals(DRB_TOKEN)
-    weth_dec = erc20_decimals(WETH_TOKEN)
+def _fetch_balances_onchain_batch(deadline: float | None = None):
+    """
+    Balances and pool prices for DRB and WETH in one batched RPC request
+    (decimals come from the token metadata registry).
+    Prices are None when the pool reads fail; callers fall back to DexScreener.
+    """
+    meta = token_metadata([DRB_TOKEN, WETH_TOKEN, USDC_TOKEN], deadline)
+    drb_dec = int(meta[DRB_TOKEN]["decimals"])
+    weth_dec = int(meta[WETH_TOKEN]["decimals"])
+    usdc_dec = int(meta[USDC_TOKEN]["decimals"])
+
+    calls = [
+        ("eth_call", _eth_call_params(DRB_TOKEN, _balance_of_data(GROK_WALLET))),
+        ("eth_call", _eth_call_params(WETH_TOKEN, _balance_of_data(GROK_WALLET))),
+    ]
+
+    drb_pool = weth_pool = None
+    if PRICE_SOURCE == "onchain":
+        try:
+            drb_pool = _discover_v3_pool(DRB_TOKEN, WETH_TOKEN, DRB_WETH_POOL, deadline)
+            weth_pool = _discover_v3_pool(WETH_TOKEN, USDC_TOKEN, WETH_USDC_POOL, deadline)
+        except Exception as e:
+            print("pool discovery error:", repr(e))
+    if drb_pool and weth_pool:
+        calls.append(("eth_call", _eth_call_params(drb_pool, _SEL_SLOT0)))
+        calls.append(("eth_call", _eth_call_params(weth_pool, _SEL_SLOT0)))
+
+    # Pool reads are optional: DexScreener covers them
+    res = _rpc_batch(calls, deadline, required=[0, 1])
+    if any(r is None for r in res[:2]):
+        raise RuntimeError("Balance RPC batch failed")
+
+    drb_raw = int(res[0], 16)
+    weth_raw = int(res[1], 16)
+
+    drb_price = weth_price = None
+    if len(res) == 4 and res[2] and res[3]:
+        try:
+            weth_price = _price_from_slot0(res[3], WETH_TOKEN, USDC_TOKEN, weth_dec, usdc_dec)
+            drb_price = _price_from_slot0(res[2], DRB_TOKEN, WETH_TOKEN, drb_dec, weth_dec) * weth_price
+        except Exception as e:
+            print("onchain price error:", repr(e))
+            drb_price = weth_price = None
+
+    return drb_dec, weth_dec, drb_raw, weth_raw, drb_price, weth_price
+
 
-    drb_raw = erc20_balance_of(DRB_TOKEN, GROK_WALLET)
-    weth_raw = erc20_balance_of(WETH_TOKEN, GROK_WALLET)
+def fetch_balances_and_values(deadline: float | None = None):
+    drb_dec, weth_dec, drb_raw, weth_raw, drb_price, weth_price = _fetch_balances_onchain_batch(deadline)
 
     drb_amt = drb_raw / 10 ** drb_dec
     weth_amt = weth_raw / 10 ** weth_dec
 
-    drb_price = fetch_price_usd(DRB_TOKEN)
-    weth_price = fetch_price_usd(WETH_TOKEN)
+    if drb_price is None or weth_price is None:
+        drb_price = fetch_price_usd(DRB_TOKEN, deadline)
+        weth_price = fetch_price_usd(WETH_TOKEN, deadline)
+    else:
+        _crosscheck_prices({DRB_TOKEN: drb_price, WETH_TOKEN: weth_price})
+        try:
+            if DRB_TOKEN in _PRICE_CROSSCHECK["deviating"]:
+                drb_price = fetch_price_usd(DRB_TOKEN, deadline)
+            if WETH_TOKEN in _PRICE_CROSSCHECK["deviating"]:
+                weth_price = fetch_price_usd(WETH_TOKEN, deadline)
+        except Exception as e:
+            print("dexscreener price error, keeping onchain:", repr(e))
 
     drb_usd = drb_amt * drb_price
     weth_usd = weth_amt * weth_price
 
+    # FDV from the registry's total supply (already in memory), same price as the balances
+    supply = token_metadata([DRB_TOKEN], deadline)[DRB_TOKEN].get("total_supply")
+    drb_fdv = int(supply) / 10 ** drb_dec * drb_price if supply else None
+
     return {
         "DRB": {
             "amount": f"{drb_amt:,.0f}",
             "amount_float": float(drb_amt),
             "usd": fmt_usd(drb_usd),
             "usd_float": float(drb_usd),
+            "price": float(drb_price),
+            "fdv": drb_fdv,
         },
         "WETH": {
             "amount": f"{weth_amt:,.2f}",
@@ -470,26 +1070,41 @@ def _deep_find_first_usd(obj):
     return None
 
 
-def fetch_historical_fees_claimed():
-    try:
-        r = requests.get(GROK_WALLET_URL, headers=UA_HEADERS, timeout=20)
-        r.raise_for_status()
-        html = r.text or ""
-
-        next_data = _parse_next_data(html)
-        if next_data:
-            usd = _deep_find_first_usd(next_data)
+_NEXT_DATA_MARKER = 'id="__NEXT_DATA__"'
+_FEES_CLAIMED_RE = re.compile(r'(\$[\d\.,]+)\s*Historical\s+Fees\s+Claimed', re.IGNORECASE)
+
+
+def _extract_fees_claimed(html: str, done: bool, state: dict):
+    """Fees from partial thegrokwallet HTML; waits for a complete __NEXT_DATA__ or the end."""
+    if "next_data" not in state:
+        start = html.find(_NEXT_DATA_MARKER, state.get("pos", 0))
+        if start == -1:
+            state["pos"] = max(0, len(html) - len(_NEXT_DATA_MARKER) + 1)
+            if not done:
+                return None
+        else:
+            state["pos"] = start
+            end = html.find("</script>", state.get("end_pos", start))
+            if end == -1 and not done:
+                state["end_pos"] = max(start, len(html) - len("</script>") + 1)
+                return None
+            # Parsed once, when the script tag is complete
+            state["next_data"] = _parse_next_data(html[start:]) if end != -1 else None
+            usd = _deep_find_first_usd(state["next_data"]) if state["next_data"] else None
             if usd:
                 return usd
 
-        m = re.search(
-            r'(\$[\d\.,]+)\s*Historical\s+Fees\s+Claimed',
-            html,
-            re.IGNORECASE,
-        )
-        if m:
-            return m.group(1)
+    # Text fallback, scanning only what wasn't searched yet (with overlap for split matches)
+    m = _FEES_CLAIMED_RE.search(html, max(0, state.get("re_pos", 0) - 200))
+    state["re_pos"] = len(html)
+    if m:
+        return m.group(1)
+    return None
 
+
+def fetch_historical_fees_claimed(deadline: float | None = None):
+    try:
+        return _stream_scrape(GROK_WALLET_URL, UA_HEADERS, _extract_fees_claimed, deadline)
     except Exception:
         pass
 
@@ -525,7 +1140,10 @@ def generate_balance_donut(
     ax.text(0, 0, f"${total:,.0f}", ha="center", va="center", fontsize=30, fontweight="bold")
     ax.text(0, -0.20, "Total Balance", ha="center", va="center", fontsize=11, color="#666")
 
-    labels = [f"DRB\n{drb_amount_label}", f"WETH\n{weth_amount_label}"]
+    labels = [
+        f"{token_symbol(DRB_TOKEN, 'DRB')}\n{drb_amount_label}",
+        f"{token_symbol(WETH_TOKEN, 'WETH')}\n{weth_amount_label}",
+    ]
     for w, t in zip(wedges, labels):
         ang = (w.theta1 + w.theta2) / 2.0
         r = 0.82
@@ -542,12 +1160,70 @@ def generate_balance_donut(
             color="#ffffff",
         )
 
-    buf = BytesIO()
     plt.tight_layout()
-    plt.savefig(buf, format="png", dpi=170, bbox_inches="tight")
-    buf.seek(0)
+
+    # Rasterize once and crop like savefig(bbox_inches="tight"), so every
+    # profile's encode_ms covers the same step: encoding this image
+    fig.set_dpi(DONUT_DPI)
+    fig.canvas.draw()
+    w, h = fig.canvas.get_width_height()
+    img = Image.frombuffer("RGBA", (w, h), fig.canvas.buffer_rgba(), "raw", "RGBA", 0, 1)
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(0.1)  # inches, savefig's default pad
+    dpi = fig.dpi
+    img = img.crop((
+        max(0, int(bbox.x0 * dpi)),
+        max(0, int(h - bbox.y1 * dpi)),
+        min(w, int(math.ceil(bbox.x1 * dpi))),
+        min(h, int(math.ceil(h - bbox.y0 * dpi))),
+    ))
     plt.close(fig)
-    return buf
+    return encode_image(img, "donut")
+
+
+def fetch_grok_stats_cached(deadline: float | None = None) -> dict:
+    """Holders for /grok with 15-minute cache (price and FDV come with the balances)."""
+    cached = cache_get("grok_stats", "DRB")
+    if cached is not CACHE_MISS:
+        return cached
+
+    holders = basescan_token_holder_count(DRB_TOKEN, deadline)
+
+    # A None from a lookup that ran out of budget (basescan_token_holder_count
+    # swallows its errors) is unknown, not unavailable: use the last known value
+    # and don't cache, so the next command tries again. A genuine None is cached
+    # and shown as N/A
+    if holders is None and deadline is not None and time.monotonic() >= deadline:
+        return last_known_grok_stats()
+
+    data = {"holders": holders}
+    cache_set("grok_stats", "DRB", data)
+    return data
+
+
+def last_known_grok_stats() -> dict:
+    """Expired cached stats marked stale, or None holders (rendered as N/A)."""
+    cached = cache_get("grok_stats", "DRB", allow_stale=True)
+    if cached is not CACHE_MISS:
+        return {**cached, "stale": True}
+    return {"holders": None, "stale": True}
+
+
+def drb_price_and_fdv(balances: dict, deadline: float | None = None):
+    """
+    DRB price and FDV for the caption: the values priced with the balances
+    (on-chain pool price, FDV from the registry's total supply), with DexScreener
+    only as a fallback when either is missing.
+    """
+    price = balances["DRB"].get("price")
+    fdv = balances["DRB"].get("fdv")
+    if price is None or fdv is None:
+        try:
+            dex_price, dex_fdv = fetch_price_and_fdv(DRB_TOKEN, deadline)
+            price = price if price is not None else dex_price
+            fdv = fdv if fdv is not None else dex_fdv
+        except Exception as e:
+            print("dexscreener stats error:", repr(e))
+    return price, fdv
 
 
 def make_balance_table_caption(
@@ -556,21 +1232,15 @@ def make_balance_table_caption(
     weth_amount_str: str,
     weth_usd_str: str,
     fees: str | None,
+    stats: dict | None = None,
+    balances_stale: bool = False,
 ) -> str:
-    """Build the CLAWD-style stats caption for /grok."""
-    now = time.time()
-
-    # Use 15-min cache for stats (price, fdv, holders)
-    cached = _GROK_STATS_CACHE.get("data")
-    if cached and (now - _GROK_STATS_CACHE["ts"]) < _GROK_STATS_CACHE_TTL:
-        price = cached["price"]
-        fdv = cached["fdv"]
-        holders = cached["holders"]
-    else:
-        price, fdv = fetch_price_and_fdv(DRB_TOKEN)
-        holders = basescan_token_holder_count(DRB_TOKEN)
-        _GROK_STATS_CACHE["ts"] = now
-        _GROK_STATS_CACHE["data"] = {"price": price, "fdv": fdv, "holders": holders}
+    """Build the CLAWD-style stats caption for /grok (stats: price, fdv, holders)."""
+    if stats is None:
+        stats = fetch_grok_stats_cached()
+    price = stats.get("price")
+    fdv = stats.get("fdv")
+    holders = stats["holders"]
 
     # DRB Stats block
     lines = []
@@ -589,8 +1259,9 @@ def make_balance_table_caption(
     lines.append(wallet_html)
 
     drb_compact = _fmt_big(drb_amount_float)
-    lines.append(f"{drb_compact} DRB ({drb_usd_str})")
-    lines.append(f"{weth_amount_str} WETH ({weth_usd_str})")
+    # Symbols come from the chain; escape them for parse_mode="HTML"
+    lines.append(f"{drb_compact} {html.escape(token_symbol(DRB_TOKEN, 'DRB'))} ({drb_usd_str})")
+    lines.append(f"{weth_amount_str} {html.escape(token_symbol(WETH_TOKEN, 'WETH'))} ({weth_usd_str})")
 
     # Total value
     try:
@@ -601,17 +1272,31 @@ def make_balance_table_caption(
     except Exception:
         pass
 
+    stale_parts = []
+    if stats.get("stale"):
+        stale_parts.append("stats")
+    if balances_stale:
+        stale_parts.append("balances")
+    if stale_parts:
+        lines.append("")
+        lines.append(f"<i>⚠️ Live data unavailable, showing last known {' and '.join(stale_parts)}</i>")
+
     return "\n".join(lines)
 
 
 # ================= GROK2 STYLE CARD =================
 
+# The website shows wrapped ETH as plain ETH
+_CARD_SYMBOLS = {"WETH": "ETH"}
+
+
 def generate_grok_web_style_card(
     total_usd: float,
     weth_amount_float: float,
     weth_usd: float,
     drb_amount_float: float,
     drb_usd: float,
+    stale: bool = False,
 ):
     bg = Image.open(GROK_BG_PATH).convert("RGBA")
     bg = bg.resize((CARD_W, CARD_H), Image.LANCZOS)
@@ -634,7 +1319,7 @@ def generate_grok_web_style_card(
     # Header texts (no auth line, no address, no 24h, no footer)
     _draw_center_shadow(d, "GROK WALLET", fonts["title"], y=62, width=CARD_W, fill=WHITE, shadow=(0, 0, 0, 120))
     _draw_center_shadow(d, f"${total_usd:,.0f}", fonts["big"], y=148, width=CARD_W, fill=WHITE, shadow=(0, 0, 0, 120))
-    _text_center(d, "Live Balance", fonts["mid"], y=264, width=CARD_W, fill=MUTED)
+    _text_center(d, "Cached Balance" if stale else "Live Balance", fonts["mid"], y=264, width=CARD_W, fill=MUTED)
 
     # Inner boxes
     box_y1 = 324
@@ -657,11 +1342,13 @@ def generate_grok_web_style_card(
     drb_amt_str = fmt_compact_b(drb_amount_float)
     drb_usd_str = fmt_usd(drb_usd)
 
+    weth_sym = token_symbol(WETH_TOKEN, "WETH")
+
     # Center the 3-line blocks vertically inside each box
     draw_box_text_centered(
         draw=d,
         box=left,
-        sym="ETH",
+        sym=_CARD_SYMBOLS.get(weth_sym, weth_sym),
         amount=eth_amt_str,
         usd=eth_usd_str,
         font_sym=fonts["box_sym"],
@@ -675,7 +1362,7 @@ def generate_grok_web_style_card(
     draw_box_text_centered(
         draw=d,
         box=right,
-        sym="DRB",
+        sym=token_symbol(DRB_TOKEN, "DRB"),
         amount=drb_amt_str,
         usd=drb_usd_str,
         font_sym=fonts["box_sym"],
@@ -686,39 +1373,163 @@ def generate_grok_web_style_card(
         color_usd=MUTED,
     )
 
-    buf = BytesIO()
-    canvas.convert("RGB").save(buf, format="PNG", optimize=True)
-    buf.seek(0)
-    return buf
+    return encode_image(canvas, "card")
 
 
 # ================= BALANCES CACHE (15 min) =================
 
-_BALANCES_CACHE = {"ts": 0, "data": None}
-_BALANCES_CACHE_TTL = 900  # 15 minutes
-
-
-def fetch_balances_cached():
+def fetch_balances_cached(deadline: float | None = None):
     """Fetch wallet balances with 15-minute cache."""
-    now = time.time()
-    if _BALANCES_CACHE["data"] and (now - _BALANCES_CACHE["ts"]) < _BALANCES_CACHE_TTL:
-        return _BALANCES_CACHE["data"]
+    cached = cache_get("balances", GROK_WALLET)
+    if cached is not CACHE_MISS:
+        return cached
 
-    data = fetch_balances_and_values()
-    _BALANCES_CACHE["ts"] = now
-    _BALANCES_CACHE["data"] = data
+    data = fetch_balances_and_values(deadline)
+    cache_set("balances", GROK_WALLET, data)
     return data
 
 
+def last_known_balances():
+    """Expired cached balances (kept past TTL for degraded replies), or None."""
+    cached = cache_get("balances", GROK_WALLET, allow_stale=True)
+    return None if cached is CACHE_MISS else cached
+
+
+# ================= DEADLINES =================
+
+async def _run_with_deadline(deadline: float, fn, *args):
+    """
+    Run a blocking fetch in a worker thread and stop waiting at `deadline`.
+    The thread itself winds down on its own request timeouts (see _timeout_for).
+    """
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError("Command deadline exceeded")
+    return await asyncio.wait_for(asyncio.to_thread(fn, *args), timeout=left)
+
+
+async def _balances_within(deadline: float):
+    """Balances for a command: live if the budget allows, else last known (stale)."""
+    try:
+        return await _run_with_deadline(deadline, fetch_balances_cached, deadline), False
+    except Exception as e:
+        b = last_known_balances()
+        if b is None:
+            raise
+        print("balances degraded to stale:", repr(e))
+        return b, True
+
+
+# ================= SPAM CONTROL =================
+
+_SUPPRESSED = {"coalesced": 0, "cooldown": 0}
+
+
+def _admit_command(update: Update, command: str) -> bool:
+    """
+    Decide whether this command should render a reply.
+    Duplicates in the same chat while a reply is in progress (or within
+    COALESCE_WINDOW_S of it) and repeats from one user within USER_COOLDOWN_S
+    are suppressed and counted in _SUPPRESSED.
+    """
+    msg = update.message
+    user = update.effective_user
+
+    if user and USER_COOLDOWN_S > 0:
+        if cache_get("user_cooldown", (user.id, command)) is not CACHE_MISS:
+            _SUPPRESSED["cooldown"] += 1
+            return False
+
+    # A busy entry holds past its expiry (read as stale) until the reply finishes;
+    # a finished one suppresses duplicates until it expires
+    ckey = (msg.chat_id, command)
+    st, fresh = cache_lookup("chat_replies", ckey)
+    if st is not CACHE_MISS:
+        if st["busy"]:
+            st["latest"] = msg
+            _SUPPRESSED["coalesced"] += 1
+            return False
+        if COALESCE_WINDOW_S > 0 and fresh:
+            _SUPPRESSED["coalesced"] += 1
+            return False
+
+    if user and USER_COOLDOWN_S > 0:
+        cache_set("user_cooldown", (user.id, command), True)
+
+    cache_set("chat_replies", ckey, {"busy": True, "latest": None})
+    return True
+
+
+def _reply_target(msg, command: str):
+    """Message to reply to: the newest coalesced duplicate if configured, else msg."""
+    st = cache_get("chat_replies", (msg.chat_id, command), allow_stale=True)
+    if COALESCE_REPLY_TO_LATEST and st is not CACHE_MISS and st["latest"] is not None:
+        return st["latest"]
+    return msg
+
+
+async def _reply_photo(msg, command: str, photo: BytesIO, **kwargs):
+    """
+    Reply with a photo to _reply_target(); if that duplicate was deleted in the
+    meantime (BadRequest), reply to the original request instead.
+    """
+    target = _reply_target(msg, command)
+    try:
+        return await target.reply_photo(photo=photo, **kwargs)
+    except BadRequest:
+        if target is msg:
+            raise
+        photo.seek(0)
+        return await msg.reply_photo(photo=photo, allow_sending_without_reply=True, **kwargs)
+
+
+def _finish_command(msg, command: str, ok: bool):
+    # A failed reply does not open a coalescing window, so the next request retries
+    if not ok:
+        cache_delete("chat_replies", (msg.chat_id, command))
+        return
+    # Re-set so the coalescing window starts when the reply went out
+    cache_set("chat_replies", (msg.chat_id, command), {"busy": False, "latest": None})
+
+
 # ================= COMMANDS =================
 
 async def grok_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     if not msg:
         return
+    if not _admit_command(update, "grok"):
+        return
 
+    ok = False
     try:
-        b = fetch_balances_cached()
+        # Fetches share one budget; rendering gets RENDER_RESERVE_S on top
+        deadline = time.monotonic() + max(1.0, COMMAND_BUDGET_S - RENDER_RESERVE_S)
+
+        # Independent fetches run together, each with its own stale fallback
+        balances, stats, fees = await asyncio.gather(
+            _balances_within(deadline),
+            _run_with_deadline(deadline, fetch_grok_stats_cached, deadline),
+            _run_with_deadline(deadline, fetch_historical_fees_claimed, deadline),
+            return_exceptions=True,
+        )
+        if isinstance(balances, BaseException):
+            raise balances
+        b, balances_stale = balances
+        if not isinstance(stats, dict):
+            print("stats degraded to stale:", repr(stats))
+            stats = last_known_grok_stats()
+        if not isinstance(fees, str):
+            fees = None
+
+        # Priced with the balances; DexScreener only when that left a gap
+        price, fdv = b["DRB"].get("price"), b["DRB"].get("fdv")
+        if price is None or fdv is None:
+            try:
+                price, fdv = await _run_with_deadline(deadline, drb_price_and_fdv, b, deadline)
+            except Exception as e:
+                print("price/fdv unavailable:", repr(e))
+        stats = {**stats, "price": price, "fdv": fdv}
 
         donut = generate_balance_donut(
             b["DRB"]["usd_float"],
@@ -727,17 +1538,18 @@ async def grok_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             b["WETH"]["amount_float"],
         )
 
-        fees = fetch_historical_fees_claimed()
-
         caption = make_balance_table_caption(
             drb_amount_float=b["DRB"]["amount_float"],
             drb_usd_str=b["DRB"]["usd"],
             weth_amount_str=b["WETH"]["amount"],
             weth_usd_str=b["WETH"]["usd"],
             fees=fees,
+            stats=stats,
+            balances_stale=balances_stale,
         )
 
-        await msg.reply_photo(photo=donut, caption=caption, parse_mode="HTML")
+        await _reply_photo(msg, "grok", donut, caption=caption, parse_mode="HTML")
+        ok = True
 
     except Exception as e:
         err = repr(e)
@@ -748,15 +1560,21 @@ async def grok_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except Exception:
                 pass
         await msg.reply_text("Error fetching balances")
+    finally:
+        _finish_command(msg, "grok", ok)
 
 
 async def grok2_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     if not msg:
         return
+    if not _admit_command(update, "grok2"):
+        return
 
+    ok = False
     try:
-        b = fetch_balances_cached()
+        deadline = time.monotonic() + max(1.0, COMMAND_BUDGET_S - RENDER_RESERVE_S)
+        b, stale = await _balances_within(deadline)
         total_usd = b["DRB"]["usd_float"] + b["WETH"]["usd_float"]
 
         card = generate_grok_web_style_card(
@@ -765,9 +1583,11 @@ async def grok2_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             weth_usd=b["WETH"]["usd_float"],
             drb_amount_float=b["DRB"]["amount_float"],
             drb_usd=b["DRB"]["usd_float"],
+            stale=stale,
         )
 
-        await msg.reply_photo(photo=card)
+        await _reply_photo(msg, "grok2", card)
+        ok = True
 
     except Exception as e:
         err = repr(e)
@@ -778,6 +1598,30 @@ async def grok2_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except Exception:
                 pass
         await msg.reply_text("Error fetching balances")
+    finally:
+        _finish_command(msg, "grok2", ok)
+
+
+async def botstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin-only: suppression counters and last render stats."""
+    msg = update.message
+    user = update.effective_user
+    if not msg or not user or ADMIN_ID <= 0 or user.id != ADMIN_ID:
+        return
+
+    lines = [
+        f"Suppressed (coalesced): {_SUPPRESSED['coalesced']:,}",
+        f"Suppressed (user cooldown): {_SUPPRESSED['cooldown']:,}",
+    ]
+    for name, st in cache_stats().items():
+        lines.append(
+            f"Cache {name}: {st['hits']:,} hits, {st['misses']:,} misses, "
+            f"{st['stale_hits']:,} stale, {st['evictions']:,} evicted, size {st['size']}"
+        )
+    for kind, st in _RENDER_STATS.items():
+        lines.append(f"Last {kind}: {st['profile']} {st['bytes']:,} bytes, {st['encode_ms']:.1f} ms")
+
+    await msg.reply_text("\n".join(lines))
 
 
 # ================= BOOT =================
@@ -795,11 +1639,15 @@ def main():
         ApplicationBuilder()
         .token(BOT_TOKEN)
         .post_init(on_startup)
+        # Handlers await fetches in worker threads; let other updates (and
+        # duplicate-command coalescing) proceed meanwhile
+        .concurrent_updates(True)
         .build()
     )
 
     app.add_handler(CommandHandler("grok", grok_command))
     app.add_handler(CommandHandler("grok2", grok2_command))
+    app.add_handler(CommandHandler("botstats", botstats_command))
 
     app.run_polling()
 